@@ -1,21 +1,250 @@
 # app.py
 
-from quart import Quart, render_template, request, jsonify, Response, send_file # Added send_file
+from quart import Quart, render_template, request, jsonify, Response
 from dotenv import load_dotenv
+import collections
 import os
-import json
-import io
+import orjson
 import scraper_logic
 import asyncio
+import concurrent.futures
 from uuid import uuid4
 import atexit
-import re
+import time
+import logging
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Quart(__name__)
-tasks = {} # Stores task status and queues
-results = {} # Stores scraping results
+
+class TaskRegistry:
+    """Size- and TTL-bounded registry for in-flight task state.
+
+    The old module dict leaked every task a client never streamed, and
+    event_generator popped the entry the moment the *first* SSE client
+    disconnected — killing reconnects. Entries now live until their TTL
+    expires or until the last subscriber disconnects from a finished task.
+    """
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict() # task_id -> entry dict
+
+    def __setitem__(self, task_id, entry):
+        entry['_expires_at'] = time.monotonic() + self.ttl
+        entry.setdefault('_subscribers', 0)
+        self._data[task_id] = entry
+        self._data.move_to_end(task_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __getitem__(self, task_id):
+        entry = self._data[task_id]
+        entry['_expires_at'] = time.monotonic() + self.ttl
+        self._data.move_to_end(task_id)
+        return entry
+
+    def __contains__(self, task_id):
+        return task_id in self._data
+
+    def get(self, task_id, default=None):
+        if task_id not in self._data:
+            return default
+        return self[task_id]
+
+    def pop(self, task_id, default=None):
+        return self._data.pop(task_id, default)
+
+    def subscribe(self, task_id):
+        entry = self[task_id]
+        entry['_subscribers'] += 1
+        entry['_ever_subscribed'] = True
+
+    def unsubscribe(self, task_id):
+        entry = self._data.get(task_id)
+        if entry is None:
+            return
+        entry['_subscribers'] -= 1
+        self.release_if_done(task_id)
+
+    def release_if_done(self, task_id):
+        """Drop a finished entry once no stream is (or will be) reading it."""
+        entry = self._data.get(task_id)
+        if (entry is not None and entry.get('status') == 'finished'
+                and entry.get('_subscribers', 0) <= 0
+                and entry.get('_ever_subscribed')):
+            del self._data[task_id]
+
+    def sweep(self):
+        """Evict expired entries nobody is streaming (abandoned tasks)."""
+        now = time.monotonic()
+        for task_id in [
+            tid for tid, e in self._data.items()
+            if e['_expires_at'] < now and e.get('_subscribers', 0) <= 0
+        ]:
+            del self._data[task_id]
+
+tasks = TaskRegistry(
+    maxsize=int(os.getenv('TASKS_MAX', '1024')),
+    ttl=float(os.getenv('TASKS_TTL_SECONDS', '300')),
+) # Stores task status and queues
+
+class _TTLCache:
+    """Minimal size- and TTL-bounded store for finished scrape results.
+
+    Nothing ever removed entries from the old module-level results dict, so
+    every completed scrape leaked its full payload for the process lifetime.
+    """
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = {} # key -> (expires_at, value); insertion-ordered
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        self._expire(now)
+        while len(self._data) >= self.maxsize:
+            # Oldest insertion goes first once we're full.
+            del self._data[next(iter(self._data))]
+        self._data[key] = (now + self.ttl, value)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _expire(self, now):
+        for key in [k for k, (exp, _) in self._data.items() if exp < now]:
+            del self._data[key]
+
+# Stores scraping results until downloaded or expired.
+results = _TTLCache(
+    maxsize=int(os.getenv('RESULTS_MAX', '1024')),
+    ttl=float(os.getenv('RESULTS_TTL_SECONDS', '3600')),
+)
+
+# SSE frame delimiters, precomputed so the writer only appends bytes.
+SSE_PREFIX = b'data: '
+SSE_SUFFIX = b'\n\n'
+
+_FRAME_CACHE = {}
+
+def _frame(obj, cache_key=None):
+    """Encodes one SSE frame, caching the bytes for repeated sentinel shapes."""
+    if cache_key is not None:
+        frame = _FRAME_CACHE.get(cache_key)
+        if frame is None:
+            frame = _FRAME_CACHE[cache_key] = SSE_PREFIX + orjson.dumps(obj) + SSE_SUFFIX
+        return frame
+    return SSE_PREFIX + orjson.dumps(obj) + SSE_SUFFIX
+
+# Fixed first frame of every stream, encoded once at import.
+_CONNECTED_FRAME = SSE_PREFIX + orjson.dumps(
+    {'type': 'info', 'content': 'Log stream connected.'}) + SSE_SUFFIX
+
+# Cap per-task log queues so a slow/disconnected SSE client can't buffer
+# unbounded log entries (scrape_result payloads can be megabytes each).
+LOG_QUEUE_MAX = int(os.getenv('LOG_QUEUE_MAX', '1000'))
+
+class Admission:
+    """Caps the number of concurrently running scrape tasks.
+
+    Uses an asyncio.Condition instead of a Semaphore so the cap can be
+    resized at runtime via set_cmax() without poking internal counters.
+    """
+    def __init__(self, cmax):
+        self.cmax = cmax
+        self.active = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.active < self.cmax)
+            self.active += 1
+
+    async def release(self):
+        async with self.cond:
+            self.active -= 1
+            self.cond.notify(1)
+
+    async def set_cmax(self, n):
+        async with self.cond:
+            self.cmax = n
+            self.cond.notify_all()
+
+# One POST used to spawn len(channels) Playwright tasks with no cap at all.
+scrape_admission = Admission(int(os.getenv('SCRAPE_CONCURRENCY', '4')))
+
+# CPU-bound post-processing (serializing multi-MB channel results) runs on
+# this pool so it never stalls SSE delivery on the event loop thread.
+SCRAPER_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv('WORKER_POOL_SIZE', '4'))
+)
+atexit.register(SCRAPER_EXECUTOR.shutdown)
+
+# Long-lived consumer pool: /scrape pushes one job per channel onto this
+# queue instead of spawning a coroutine per channel in the handler.
+SCRAPE_WORKERS = int(os.getenv('SCRAPE_WORKERS', '4'))
+scrape_queue = None # Created at startup, once the event loop exists
+_scrape_worker_tasks = []
+
+async def _scrape_worker():
+    """Consumes channel-scrape jobs for the lifetime of the app."""
+    while True:
+        job = await scrape_queue.get()
+        try:
+            await scrape_admission.acquire()
+            try:
+                await scraper_logic.scrape_messages_task(
+                    job['url'], job['username'], job['password'],
+                    job['channel_url'], job['depth'], job['log_queue']
+                )
+            finally:
+                await scrape_admission.release()
+        except Exception as e:
+            await scraper_logic.log_update(
+                job['log_queue'], "error", f"Scrape worker error for {job['channel_url']}: {e}"
+            )
+        finally:
+            job['done'].set()
+            scrape_queue.task_done()
+
+async def _sweep_tasks():
+    """Periodically drops abandoned task entries past their TTL."""
+    while True:
+        await asyncio.sleep(60)
+        tasks.sweep()
+
+@app.before_serving
+async def _start_scrape_workers():
+    global scrape_queue
+    scrape_queue = asyncio.Queue()
+    for _ in range(SCRAPE_WORKERS):
+        _scrape_worker_tasks.append(asyncio.create_task(_scrape_worker()))
+    # Cancelled alongside the workers at shutdown.
+    _scrape_worker_tasks.append(asyncio.create_task(_sweep_tasks()))
+    # Launch Chromium and spin up a throwaway page on the running loop so
+    # the first request pays neither browser nor renderer cold-start.
+    await scraper_logic.warmup()
+
+@app.after_serving
+async def _stop_scrape_workers():
+    for worker in _scrape_worker_tasks:
+        worker.cancel()
+    _scrape_worker_tasks.clear()
+    # Close Playwright while the loop is still alive; an atexit handler
+    # would fire after uvicorn has already torn the loop down.
+    await scraper_logic.close_browser()
 
 @app.route('/')
 async def index():
@@ -32,6 +261,7 @@ async def run_login_task_wrapper(task_id, url, username, password):
         await scraper_logic.log_update(log_queue, "end_stream", "Process failed abruptly.")
     finally:
         if task_id in tasks: tasks[task_id]['status'] = 'finished'
+        tasks.release_if_done(task_id)
 
 # --- Wrapper for scraping task ---
 async def run_scrape_task_wrapper(task_id, url, username, password, channel_url, depth):
@@ -44,16 +274,20 @@ async def run_scrape_task_wrapper(task_id, url, username, password, channel_url,
         await scraper_logic.log_update(log_queue, "end_stream", f"Scraping failed abruptly for {channel_url}.")
     finally:
          if task_id in tasks: tasks[task_id]['status'] = 'finished' # Mark individual task finished
+         tasks.release_if_done(task_id)
 
 @app.route('/connect_and_enumerate', methods=['POST'])
 async def connect_and_enumerate_channels_route():
-    data = await request.get_json()
+    try:
+        data = orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        return jsonify({"success": False, "error": "Malformed JSON body."}), 400
     url, username, password = data.get('url'), data.get('username'), data.get('password')
     if not all([url, username, password]):
         return jsonify({"success": False, "error": "Missing data."}), 400
 
     task_id = str(uuid4())
-    log_queue = asyncio.Queue()
+    log_queue = scraper_logic.FastLogQueue(maxsize=LOG_QUEUE_MAX)
     tasks[task_id] = {
         'type': 'enumerate',
         'url': url, 'username': username, 'password': password,
@@ -65,10 +299,13 @@ async def connect_and_enumerate_channels_route():
 # --- UPDATED /scrape route ---
 @app.route('/scrape', methods=['POST'])
 async def scrape_channels_route():
-    print("\n--- Received /scrape request ---")
+    main_task_id = None
     try:
-        data = await request.get_json()
-        print(f"Scrape request data: {data}")
+        try:
+            data = orjson.loads(await request.get_data())
+        except orjson.JSONDecodeError:
+            return jsonify({"success": False, "error": "Malformed JSON body."}), 400
+        logger.debug("Scrape request data: %s", data)
         url = data.get('url')
         username = data.get('username')
         password = data.get('password')
@@ -76,43 +313,56 @@ async def scrape_channels_route():
         depth = data.get('depth')
 
         if not all([url, username, password, channels, depth]):
-            print("Scrape request missing data.")
             return jsonify({"success": False, "error": "Missing data for scraping."}), 400
 
         if not channels:
             return jsonify({"success": False, "error": "No channels selected."}), 400
 
+        # Reject malformed entries here, before anything is queued — a
+        # bad channel dict discovered inside the fire-and-forget manager
+        # task would crash it after dispatch and leave the stream hanging.
+        if not isinstance(channels, list) or not all(
+                isinstance(c, dict) and c.get('id') for c in channels):
+            return jsonify({"success": False, "error": "Each channel must be an object with an 'id'."}), 400
+
         main_task_id = str(uuid4()) # One ID to rule the stream
-        log_queue = asyncio.Queue()
+        log_queue = scraper_logic.FastLogQueue(maxsize=LOG_QUEUE_MAX)
         tasks[main_task_id] = {
             'type': 'scrape',
             'log_queue': log_queue,
             'status': 'starting',
             'sub_tasks': len(channels),
-            'results_data': [] # To store results
+            'results_data': [], # To store results
+            # Encoded once here so the all_done switch-over does no JSON work.
+            '_download_frame': _frame({'type': 'download_ready', 'content': main_task_id}),
         }
-        print(f"Generated Main Scrape Task ID: {main_task_id}")
+        logger.debug("Generated main scrape task ID: %s", main_task_id)
 
         async def run_all_scrapes():
-            """Manages multiple scrape tasks under one main task ID."""
+            """Queues this request's channels and waits for the workers."""
             await scraper_logic.log_update(log_queue, "info", f"Starting scrape for {len(channels)} channel(s)...")
-            scrape_tasks = []
-            for channel in channels:
-                # We need a *separate* wrapper call for each channel.
-                # They will *all* log to the *same* queue.
-                channel_url = channel.get('id')
-                channel_name = channel.get('name')
-                await scraper_logic.log_update(log_queue, "info", f"Queueing scrape for: {channel_name}")
-                # We pass the *main* task_id so the wrapper can find the queue
-                scrape_tasks.append(
-                    asyncio.create_task(
-                        scraper_logic.scrape_messages_task(
-                            url, username, password, channel_url, depth, log_queue
-                        )
-                    )
-                )
-            # Wait for all individual scraping tasks to complete
-            await asyncio.gather(*scrape_tasks)
+            # Extract once, dispatch first, then log the whole batch with a
+            # single queue put instead of one await per channel.
+            # The route guarantees 'id'; 'name' is display-only, so fall
+            # back to the id rather than trusting it to exist.
+            jobs = [(c['id'], str(c.get('name') or c['id'])) for c in channels]
+            done_events = []
+            for channel_url, _ in jobs:
+                # One job per channel; they all log to the *same* queue.
+                done = asyncio.Event()
+                done_events.append(done)
+                await scrape_queue.put({
+                    'url': url, 'username': username, 'password': password,
+                    'channel_url': channel_url, 'depth': depth,
+                    'log_queue': log_queue, 'done': done,
+                })
+            await scraper_logic.log_update(
+                log_queue, "info", "Queued scrapes for: " + ", ".join(name for _, name in jobs)
+            )
+            # Wait for this request's jobs only (queue.join() would block on
+            # other requests' jobs too).
+            for done in done_events:
+                await done.wait()
             # Once all are done, send a final 'all_done' message
             await scraper_logic.log_update(log_queue, "all_done", main_task_id)
             await scraper_logic.log_update(log_queue, "end_stream", "All scraping tasks finished.")
@@ -120,12 +370,15 @@ async def scrape_channels_route():
         # Start the manager task
         asyncio.create_task(run_all_scrapes())
         tasks[main_task_id]['status'] = 'running'
-        print(f"Returning main task ID {main_task_id} to client.")
         return jsonify({"success": True, "task_id": main_task_id})
 
     except Exception as e:
-        print(f"!!! ERROR in /scrape: {e}")
-        traceback.print_exc()
+        # The old handler called traceback.print_exc() without importing
+        # traceback, so every failure raised NameError and left the half-
+        # initialized task (and its queue) stuck in 'starting' forever.
+        logger.exception("scrape route failed")
+        if main_task_id is not None:
+            tasks.pop(main_task_id, None)
         return jsonify({"success": False, "error": f"Internal server error: {e}"}), 500
 
 @app.route('/stream/<task_id>')
@@ -135,35 +388,65 @@ async def stream_logs(task_id):
 
     log_queue = tasks[task_id]['log_queue']
 
+    SSE_BATCH_MAX = 32
+
     async def event_generator():
-        yield f"data: {json.dumps({'type': 'info', 'content': 'Log stream connected.'})}\n\n"
-        while True:
-            log_entry = await log_queue.get()
-            log_queue.task_done()
-
-            # --- Handle Scrape Results ---
-            if log_entry.get("type") == "scrape_result":
-                tasks[task_id]['results_data'].append(log_entry.get("content"))
-                channel_name = log_entry["content"]["channel_name"]
-                content_str = f"Received results for {channel_name}"
-                data_to_send = {'type': 'info', 'content': content_str}
-                yield f"data: {json.dumps(data_to_send)}\n\n"
-                continue # Don't send full results down stream, just info
-
-            # --- Handle 'All Done' for Scraping ---
-            if log_entry.get("type") == "all_done":
-                # Store results globally using the task_id
-                results[task_id] = tasks[task_id]['results_data']
-                yield f"data: {json.dumps({'type': 'download_ready', 'content': task_id})}\n\n"
-                # Keep stream open until 'end_stream'
-
-            yield f"data: {json.dumps(log_entry)}\n\n"
-            if log_entry.get("type") == "end_stream":
-                break
-        # --- Cleanup ---
-        print(f"Closing stream & cleaning task for {task_id}.")
-        # Don't pop results, just the task metadata
-        tasks.pop(task_id, None)
+        tasks.subscribe(task_id)
+        try:
+            yield _CONNECTED_FRAME
+            async for chunk in _stream_events():
+                yield chunk
+        finally:
+            # Entry survives disconnects while the task runs (reconnects keep
+            # working); the registry drops it once finished and unobserved.
+            logger.debug("Closing stream for %s.", task_id)
+            tasks.unsubscribe(task_id)
+
+    async def _stream_events():
+        ended = False
+        while not ended:
+            # Block for the first entry, then drain whatever else is already
+            # queued so chatty bursts become one socket write, not one per line.
+            batch = [await log_queue.get()]
+            batch += log_queue.drain_nowait(SSE_BATCH_MAX - 1)
+
+            out = bytearray()
+            for log_entry in batch:
+                # Pre-serialized frames from scraper_logic: pure byte pump.
+                if isinstance(log_entry, tuple) and log_entry[0] == 'bytes':
+                    out += SSE_PREFIX
+                    out += log_entry[1]
+                    out += SSE_SUFFIX
+                    continue
+
+                entry_type = log_entry.get("type")
+
+                # --- Handle Scrape Results ---
+                if entry_type == "scrape_result":
+                    tasks[task_id]['results_data'].append(log_entry.get("content"))
+                    channel_name = log_entry["content"]["channel_name"]
+                    content_str = f"Received results for {channel_name}"
+                    out += _frame({'type': 'info', 'content': content_str})
+                    continue # Don't send full results down stream, just info
+
+                # --- Handle 'All Done' for Scraping ---
+                if entry_type == "all_done":
+                    # Hand the results to the TTL store; pop the alias so the
+                    # task entry doesn't keep the payload alive too.
+                    results[task_id] = tasks[task_id].pop('results_data', [])
+                    out += tasks[task_id].get('_download_frame') or \
+                        _frame({'type': 'download_ready', 'content': task_id})
+                    # The raw all_done dict only carried the task_id we just
+                    # sent; don't encode and ship it a second time.
+                    continue # Keep stream open until 'end_stream'
+
+                out += SSE_PREFIX
+                out += orjson.dumps(log_entry)
+                out += SSE_SUFFIX
+                if entry_type == "end_stream":
+                    ended = True
+                    break
+            yield bytes(out)
 
     response = Response(event_generator(), mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache'
@@ -180,23 +463,24 @@ async def download_results(task_id):
     if not data_to_download:
          return "No data found for this task ID.", 404
 
-    # Create a JSON file in memory
-    str_io = io.StringIO()
-    json.dump(data_to_download, str_io, indent=4)
-    mem_io = io.BytesIO(str_io.getvalue().encode('utf-8'))
-    mem_io.seek(0)
+    # Stream one channel result per chunk instead of materializing the whole
+    # payload in memory; first byte goes out after the first orjson call.
+    async def json_stream():
+        loop = asyncio.get_running_loop()
+        yield b'['
+        for i, channel_result in enumerate(data_to_download):
+            if i:
+                yield b','
+            yield await loop.run_in_executor(SCRAPER_EXECUTOR, orjson.dumps, channel_result)
+        yield b']'
 
-    # Clean up the stored result after preparing download (optional)
-    # results.pop(task_id, None)
-
-    return await send_file(
-        mem_io,
-        mimetype='application/json',
-        as_attachment=True,
-        attachment_filename=f'kumocrawler_scrape_{task_id[:8]}.json'
+    response = Response(json_stream(), mimetype='application/json')
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename=kumocrawler_scrape_{task_id[:8]}.json'
     )
-
-atexit.register(scraper_logic.close_browser) # Changed to call the sync wrapper
+    return response
 
 if __name__ == '__main__':
-    print("To run locally without Docker: uvicorn app:app --host 0.0.0.0 --port 5000 --reload")
\ No newline at end of file
+    # Run natively under uvicorn; no dev-server / nested-loop shims.
+    import uvicorn
+    uvicorn.run("app:app", host="0.0.0.0", port=5000, loop="uvloop", http="httptools")
\ No newline at end of file
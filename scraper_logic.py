@@ -1,12 +1,35 @@
 # scraper_logic.py
 
 import asyncio
+import atexit
+import collections
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue as _thread_queue
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
 from datetime import datetime, timedelta
-import random
+from urllib.parse import urljoin, urlsplit
 import re
-import json
-import traceback # For explicit traceback printing
+import time
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Stdout writes go through a QueueHandler -> QueueListener pair so the event
+# loop never blocks on a flush (Docker pipes stdout unbuffered).
+_log_record_queue = _thread_queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_record_queue, logging.StreamHandler())
+logger.addHandler(logging.handlers.QueueHandler(_log_record_queue))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+_LOG_LEVELS = {
+    "error": logging.ERROR,
+    "warn": logging.WARNING,
+    "dev": logging.DEBUG,
+}
 
 # --- SELECTORS (Consolidated and Updated based on your HTML inspections) ---
 SELECTORS = {
@@ -32,20 +55,487 @@ SELECTORS = {
     "loading_indicator": '.rcx-loading, .loading-animation', # Verify if it appears on scroll
 }
 
+# --- BATCH EXTRACTORS ---
+# One page.evaluate returns everything in a single CDP round-trip instead of
+# 3-7 protocol calls per element (the old per-element loops were latency-bound
+# on the CDP WebSocket, not on the page itself).
+_CHANNELS_EXTRACT_JS = """(els, nameSel) => {
+    const out = [];
+    for (const el of els) {
+        const nameEl = el.querySelector(nameSel);
+        if (!nameEl) continue;
+        const name = nameEl.textContent.trim();
+        const href = el.getAttribute('href');
+        if (name && href) out.push({ name, href });
+    }
+    return out;
+}"""
+
+# Races the login error and success indicators inside the page with a
+# MutationObserver, shipping the error banner text back in the same
+# round-trip. Probes error first so a visible banner wins over a
+# half-rendered success indicator; resolves {kind: 'timeout'} instead of
+# rejecting so the Python side keeps a single code path.
+_LOGIN_OUTCOME_JS = """(args) => new Promise((resolve) => {
+    const probe = () => {
+        const err = document.querySelector(args.error);
+        if (err) { resolve({ kind: 'error', text: err.textContent.trim() }); return true; }
+        if (document.querySelector(args.success)) { resolve({ kind: 'success', text: '' }); return true; }
+        return false;
+    };
+    if (probe()) return;
+    const obs = new MutationObserver(() => { if (probe()) obs.disconnect(); });
+    obs.observe(document.body, { childList: true, subtree: true });
+    setTimeout(() => { obs.disconnect(); resolve({ kind: 'timeout', text: '' }); }, args.timeout);
+})"""
+
+async def _wait_login_outcome(page, timeout=45000):
+    """Waits for the login to succeed or fail.
+
+    Returns ('success', '') or ('error', <banner text>); ('timeout', '')
+    if neither indicator appeared within `timeout` ms.
+    """
+    outcome = await page.evaluate(_LOGIN_OUTCOME_JS, {
+        "error": SELECTORS["login_error_indicator"],
+        "success": SELECTORS["login_success_indicator"],
+        "timeout": timeout,
+    })
+    return outcome["kind"], outcome["text"]
+
+# Evaluated against the scroll-container ElementHandle, so no selector
+# interpolation or document.querySelector per call.
+_JS_SCROLL_TOP_ZERO = "el => el.scrollTop = 0"
+_JS_GET_SCROLL_TOP = "el => el.scrollTop"
+_JS_GET_SCROLL_HEIGHT = "el => el.scrollHeight"
+
+# New content counts as either more message items or a taller scroll
+# container — virtualized lists can grow in height while keeping the
+# rendered item count constant.
+_NEW_MESSAGES_JS = """(args) => {
+    if (document.querySelectorAll(args.sel).length > args.prev) return true;
+    if (args.prevH === null) return false;
+    const c = document.querySelector(args.container);
+    return !!c && c.scrollHeight > args.prevH;
+}"""
+
+# Used with eval_on_selector_all: Playwright matches the items and hands
+# the element array straight to this function, one round-trip total.
+# A page-side Set remembers which IDs were already returned, so each pass
+# marshals only the newly loaded messages instead of the whole DOM —
+# O(new) per pass rather than O(total). `total` still reports the full
+# DOM count for the scroll loop's progress checks.
+_MESSAGES_EXTRACT_JS = """(els, sel) => {
+    const seen = (window.__kumoSeenIds ||= new Set());
+    const rows = [];
+    for (const el of els) {
+        if (!el.id || seen.has(el.id)) continue;
+        seen.add(el.id);
+        rows.push({
+            id: el.id,
+            sender: el.querySelector(sel.sender)?.textContent?.trim() || "Unknown Sender",
+            text: el.querySelector(sel.text)?.textContent?.trim() || "",
+            ts: el.querySelector(sel.ts)?.getAttribute("title") || "",
+        });
+    }
+    return { total: els.length, rows };
+}"""
+
+# The dedup set lives on window, so it survives pushState routing and
+# parked-context reuse where the document is never reloaded. Cleared on
+# every channel entry; a full page load wipes it anyway.
+_JS_RESET_SEEN_IDS = "() => { window.__kumoSeenIds = new Set(); }"
+
+# Hot-loop selector constants, resolved once at import. The scroll loop
+# touches these every pass, so the dict lookups and the rebuilt extractor
+# args dict are pure per-pass overhead.
+_MESSAGE_ITEM_SEL = SELECTORS["message_item_li"]
+_SCROLL_CONTAINER_SEL = SELECTORS["scrollable_message_container"]
+_MESSAGE_EXTRACT_ARGS = {
+    "sender": SELECTORS["message_sender"],
+    "text": SELECTORS["message_text"],
+    "ts": SELECTORS["message_timestamp"],
+}
+
+
+class _RecentIds:
+    """Bounded recent-ID window for message dedup.
+
+    A plain set of every message ID grows without bound over months-long
+    scrolls. Each DOM pass only re-shows messages near the current scroll
+    window, so remembering the most recent few thousand IDs dedups just
+    as well at O(window) memory. Only the ID's hash is stored — a machine
+    int instead of a ~40-byte string per entry, with a collision chance
+    far below the scraper's other error sources.
+    """
+    __slots__ = ('_set', '_order')
+
+    def __init__(self, maxsize=4096):
+        self._set = set()
+        self._order = collections.deque(maxlen=maxsize)
+
+    def add(self, msg_id):
+        """Record msg_id; returns False if it was already present."""
+        h = hash(msg_id)
+        if h in self._set:
+            return False
+        if len(self._order) == self._order.maxlen:
+            self._set.discard(self._order[0])
+        self._order.append(h)
+        self._set.add(h)
+        return True
+
+
+_MONTHS = {m: i for i, m in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+     "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), start=1)}
+
+# Dominant timestamp layout: "May 21, 2025 10:47 PM"
+_TS_RE = re.compile(r"^([A-Z][a-z]+) (\d{1,2}), (\d{4}) (\d{1,2}):(\d{2}) ([AP]M)$")
+# Rarer layout: "10:00 PM, August 23, 2023"
+_TS2_RE = re.compile(r"^(\d{1,2}):(\d{2}) ([AP]M), ([A-Z][a-z]+) (\d{1,2}), (\d{4})$")
+
+
+def _parse_timestamp(raw):
+    """Parse a message timestamp title, or return None.
+
+    Both known layouts go through precompiled regexes and the shared
+    month table — keyed on the first three letters, so "Aug" and
+    "August" resolve identically with no strptime, locale, or
+    try/except anywhere on the path.
+    """
+    m = _TS_RE.match(raw)
+    if m:
+        month = _MONTHS.get(m.group(1)[:3])
+        if month:
+            hour = int(m.group(4)) % 12
+            if m.group(6) == "PM":
+                hour += 12
+            return datetime(int(m.group(3)), month, int(m.group(2)),
+                            hour, int(m.group(5)))
+    m = _TS2_RE.match(raw)
+    if m:
+        month = _MONTHS.get(m.group(4)[:3])
+        if month:
+            hour = int(m.group(1)) % 12
+            if m.group(3) == "PM":
+                hour += 12
+            return datetime(int(m.group(6)), month, int(m.group(5)),
+                            hour, int(m.group(2)))
+    return None
+
+
+_SPA_NAVIGATE_JS = """(href) => {
+    history.pushState({}, '', href);
+    window.dispatchEvent(new PopStateEvent('popstate'));
+}"""
+
+
+async def _navigate_to_channel(page, channel_url, queue):
+    """Opens a channel, preferring client-side routing over a full load.
+
+    The chat UI is an SPA: pushing the new path and firing popstate keeps
+    the websocket and parsed JS alive and only loads the channel's
+    messages, instead of re-bootstrapping the whole app. Cross-origin
+    targets and failed in-app routes fall back to page.goto.
+    """
+    # Without this, re-scraping a channel on a reused context would find
+    # every message already "seen" and report zero rows forever.
+    await page.evaluate(_JS_RESET_SEEN_IDS)
+    if urlsplit(page.url)[:2] == urlsplit(channel_url)[:2]:
+        try:
+            await page.evaluate(_SPA_NAVIGATE_JS, channel_url)
+            await page.wait_for_selector(SELECTORS["room_title_header"], timeout=15000)
+            return
+        except (PlaywrightError, PlaywrightTimeoutError):
+            await log_update(queue, "dev", "In-app navigation failed; falling back to a full page load.")
+    await page.goto(channel_url, wait_until='domcontentloaded', timeout=60000)
+    await page.wait_for_selector(SELECTORS["room_title_header"], timeout=30000)
+
+
+async def _wait_for_new_messages(page, prev_count, prev_height=None, timeout=8000):
+    """Wait until the DOM holds more messages than prev_count.
+
+    Returns as soon as lazy-loaded history lands instead of sleeping a
+    fixed interval; returns False on timeout rather than raising so the
+    scroll loop can apply its own give-up logic. With prev_height given,
+    scroll-container growth past it also counts as new content.
+    """
+    try:
+        await page.wait_for_function(
+            _NEW_MESSAGES_JS,
+            arg={
+                "sel": _MESSAGE_ITEM_SEL,
+                "prev": prev_count,
+                "container": _SCROLL_CONTAINER_SEL,
+                "prevH": prev_height,
+            },
+            timeout=timeout,
+        )
+        return True
+    except PlaywrightTimeoutError:
+        return False
+
+# Compiled once at import so hot paths skip the re-module cache lookup.
+
 playwright_instance = None
 browser = None
 
+class AuthSessionPool:
+    """Caches login storage_state per (url, username) with recycling.
+
+    Long-lived Playwright state drifts (expiring tokens, leaked context
+    memory), so a cached session is retired after `recycle_after` uses and
+    the next caller logs in fresh.
+
+    With `state_dir` set, states also persist to disk so a restarted
+    process reuses a recent login instead of paying the form flow again;
+    files older than `disk_ttl` seconds are ignored.
+    """
+    def __init__(self, recycle_after=50, state_dir=None, disk_ttl=3600.0):
+        self.recycle_after = recycle_after
+        self.state_dir = state_dir
+        self.disk_ttl = disk_ttl
+        self._states = {} # key -> {'state': dict, 'uses': int}
+        self._locks = {}
+
+    def lock(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def get_state(self, key):
+        entry = self._states.get(key)
+        if entry is None:
+            state = self._load_from_disk(key)
+            if state is None:
+                return None
+            entry = self._states[key] = {'state': state, 'uses': 0}
+        if entry['uses'] >= self.recycle_after:
+            del self._states[key]
+            return None
+        entry['uses'] += 1
+        return entry['state']
+
+    def store(self, key, state):
+        self._states[key] = {'state': state, 'uses': 0}
+        if self.state_dir:
+            try:
+                os.makedirs(self.state_dir, exist_ok=True)
+                with open(self._path(key), 'wb') as f:
+                    f.write(orjson.dumps(state))
+            except OSError as e:
+                logger.warning("Could not persist auth state: %s", e)
+
+    def invalidate(self, key):
+        self._states.pop(key, None)
+        if self.state_dir:
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def _path(self, key):
+        url, username = key
+        digest = hashlib.sha256(f"{url}\n{username}".encode()).hexdigest()[:16]
+        return os.path.join(self.state_dir, f"auth-{digest}.json")
+
+    def _load_from_disk(self, key):
+        if not self.state_dir:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.disk_ttl:
+                return None
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+
+# Authenticated sessions shared by enumeration and channel-scrape tasks.
+# Set KUMO_AUTH_STATE_DIR to '' to keep sessions memory-only.
+auth_sessions = AuthSessionPool(
+    recycle_after=int(os.getenv('SESSION_RECYCLE_AFTER', '50')),
+    state_dir=os.getenv('KUMO_AUTH_STATE_DIR', '.kumo_auth'),
+    disk_ttl=float(os.getenv('KUMO_AUTH_STATE_TTL', '3600')),
+)
+
+class FastLogQueue:
+    """Single-producer/single-consumer log queue: a deque plus two Events.
+
+    asyncio.Queue adds per-item futures, wakeup and task_done bookkeeping the
+    log pipeline never uses; here put_nowait is an append plus Event.set().
+    Raises the stdlib asyncio.QueueFull/QueueEmpty so callers are unchanged.
+    """
+    __slots__ = ('buf', 'maxsize', '_ready', '_space')
+
+    def __init__(self, maxsize=0):
+        self.buf = collections.deque()
+        self.maxsize = maxsize
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def put_nowait(self, item):
+        if self.maxsize and len(self.buf) >= self.maxsize:
+            raise asyncio.QueueFull
+        self.buf.append(item)
+        self._ready.set()
+
+    async def put(self, item):
+        while self.maxsize and len(self.buf) >= self.maxsize:
+            self._space.clear()
+            await self._space.wait()
+        self.buf.append(item)
+        self._ready.set()
+
+    def get_nowait(self):
+        if not self.buf:
+            raise asyncio.QueueEmpty
+        item = self.buf.popleft()
+        self._space.set()
+        return item
+
+    def drain_nowait(self, limit):
+        """Pops up to `limit` already-queued items without exception overhead."""
+        items = []
+        while self.buf and len(items) < limit:
+            items.append(self.buf.popleft())
+        if items:
+            self._space.set()
+        return items
+
+    async def get(self):
+        while not self.buf:
+            self._ready.clear()
+            await self._ready.wait()
+        item = self.buf.popleft()
+        self._space.set()
+        return item
+
+# Entry types that must reach the client even if the consumer is slow:
+# stream control, results, and errors. Everything else is droppable chatter.
+_CRITICAL_TYPES = {"end_stream", "all_done", "scrape_result", "channels", "error"}
+# Stream terminators are delivered unconditionally: dropping all_done
+# strands the task's results (no /download), dropping end_stream leaves
+# the client's SSE connection open forever.
+_ALWAYS_DELIVER = {"end_stream", "all_done"}
+_dropped_log_count = 0
+# Surface sustained drops without logging per drop (which would re-create
+# the hot-path I/O that dropping avoids).
+_DROP_REPORT_EVERY = 1000
+
+def _note_dropped_frame():
+    global _dropped_log_count
+    _dropped_log_count += 1
+    if _dropped_log_count % _DROP_REPORT_EVERY == 0:
+        logger.warning("Log queue full: %d frames dropped so far.", _dropped_log_count)
+
+# Dev-level frames are diagnostics for the browser UI; setting
+# KUMO_DEV_LOGS=0 drops them before any encode or queue work. Checked
+# once at import so the hot paths test a plain bool.
+_DEV_LOGS = os.getenv('KUMO_DEV_LOGS', '1') != '0'
+
 async def log_update(queue, message_type, content):
-    """Helper to put structured updates onto the queue."""
+    """Helper to put structured updates onto the queue.
+
+    Critical entries apply backpressure (await space, with a timeout); chatty
+    ones are dropped when the queue is full so a slow SSE consumer can't make
+    producers buffer unboundedly. "dev" entries are skipped entirely when
+    KUMO_DEV_LOGS=0.
+    """
+    global _dropped_log_count
+    if message_type == "dev" and not _DEV_LOGS:
+        return
+    if queue:
+        if message_type in _CRITICAL_TYPES:
+            # Control/result entries stay as dicts — the SSE consumer needs
+            # to inspect them — and apply backpressure. Terminators wait
+            # as long as it takes; everything downstream (results hand-off,
+            # stream shutdown) hinges on them arriving.
+            entry = {"type": message_type, "content": content}
+            if message_type in _ALWAYS_DELIVER:
+                await queue.put(entry)
+            else:
+                try:
+                    await asyncio.wait_for(queue.put(entry), timeout=5.0)
+                except asyncio.TimeoutError:
+                    _dropped_log_count += 1
+                    logger.warning("Log queue blocked for 5s, critical message dropped: %s", message_type)
+        else:
+            # Plain log lines are serialized once here; every subscriber can
+            # then ship the same bytes without re-encoding.
+            try:
+                queue.put_nowait(('bytes', orjson.dumps({"type": message_type, "content": content})))
+            except asyncio.QueueFull:
+                _note_dropped_frame()
+    level = _LOG_LEVELS.get(message_type, logging.INFO)
+    if logger.isEnabledFor(level):
+        logger.log(level, "[%s] %s", message_type.upper(), content)
+
+def log_update_bytes(queue, frame):
+    """Enqueues a pre-serialized (droppable) frame.
+
+    The SSE generator forwards these without re-encoding, so fixed-shape
+    entries that repeat every loop pass cost zero JSON work per emit.
+    """
     if queue:
         try:
-            queue.put_nowait({"type": message_type, "content": content})
+            queue.put_nowait(('bytes', frame))
         except asyncio.QueueFull:
-            print(f"[WARN] Log queue full, message dropped: {content}")
-    print(f"[{message_type.upper()}] {content}")
+            _note_dropped_frame()
+
+# Frames for fixed log lines that repeat on every scroll pass.
+_LOOKING_FOR_MESSAGES_FRAME = orjson.dumps({"type": "dev", "content": "Looking for messages..."})
+
+class _LogBatcher:
+    """Coalesces chatty dev-level log lines into one frame.
+
+    Queue puts are cheap, but every frame still pays an encode and an SSE
+    write downstream. Buffering dev lines and flushing them as a single
+    multi-line frame turns dozens of frames per scroll pass into one;
+    callers flush at pass boundaries so latency stays bounded.
+    """
+    __slots__ = ('queue', 'buf', 'max_items')
+
+    def __init__(self, queue, max_items=16):
+        self.queue = queue
+        self.buf = []
+        self.max_items = max_items
+
+    def push(self, content):
+        if not _DEV_LOGS:
+            return
+        self.buf.append(content)
+        if len(self.buf) >= self.max_items:
+            self.flush()
+
+    def flush(self):
+        if not self.buf:
+            return
+        content = self.buf[0] if len(self.buf) == 1 else "\n".join(self.buf)
+        self.buf.clear()
+        log_update_bytes(self.queue, orjson.dumps({"type": "dev", "content": content}))
+
+_keepalive_task = None
+KEEPALIVE_INTERVAL = float(os.getenv('KUMO_BROWSER_KEEPALIVE', '30'))
+
+async def _browser_keepalive():
+    """Relaunches Chromium promptly if it dies between tasks.
+
+    Without this, the first task after a browser crash pays the full
+    launch cost; the periodic check moves that cost off the request path.
+    """
+    while True:
+        await asyncio.sleep(KEEPALIVE_INTERVAL)
+        try:
+            if browser is None or not browser.is_connected():
+                logger.warning("Browser disconnected; relaunching.")
+                await init_browser()
+        except Exception:
+            logger.exception("Browser keepalive failed")
 
 async def init_browser(queue=None):
-    global playwright_instance, browser
+    global playwright_instance, browser, _keepalive_task, _contexts_since_launch
     if not playwright_instance:
         await log_update(queue, "info", "Starting Playwright...")
         playwright_instance = await async_playwright().start()
@@ -54,12 +544,40 @@ async def init_browser(queue=None):
         # Added --no-sandbox for Docker, might need to adjust based on your Docker setup
         browser = await playwright_instance.chromium.launch(
             headless=True,
-            args=['--disable-blink-features=AutomationControlled', '--no-sandbox', '--disable-dev-shm-usage']
+            args=['--disable-blink-features=AutomationControlled', '--no-sandbox',
+                  '--disable-dev-shm-usage', '--disable-gpu',
+                  # Trim Chromium's own background traffic and first-run
+                  # work — shaves startup time and residual memory in the
+                  # container, where none of it has any use.
+                  '--disable-background-networking', '--disable-sync',
+                  '--metrics-recording-only', '--no-first-run',
+                  '--no-default-browser-check']
         )
+        _contexts_since_launch = 0
+    if _keepalive_task is None:
+        _keepalive_task = asyncio.create_task(_browser_keepalive())
     return browser
 
+async def warmup():
+    """Pre-warms the browser so the first request skips cold-start.
+
+    Beyond launching Chromium, opening (and discarding) one context and
+    page forces the first renderer process to spawn now; the keepalive
+    watchdog keeps the browser itself alive afterwards.
+    """
+    b = await init_browser()
+    context = await b.new_context()
+    try:
+        await context.new_page()
+    finally:
+        await context.close()
+
 async def close_browser():
-    global playwright_instance, browser
+    global playwright_instance, browser, _keepalive_task
+    if _keepalive_task is not None:
+        # Stop the watchdog first or it would relaunch what we just closed.
+        _keepalive_task.cancel()
+        _keepalive_task = None
     if browser and browser.is_connected():
         await log_update(None, "dev", "Closing browser...")
         await browser.close()
@@ -68,110 +586,308 @@ async def close_browser():
         await log_update(None, "dev", "Stopping Playwright instance...")
         await playwright_instance.stop()
         playwright_instance = None
-    print("Playwright closed.")
+    logger.debug("Playwright closed.")
+
+# Each Chromium context costs ~80-150MB RSS. Cap how many can be open at
+# once so a burst of jobs degrades to queueing instead of OOM.
+_CTX_SEM = asyncio.BoundedSemaphore(int(os.getenv("KUMO_MAX_CONTEXTS", "4")))
+
+# Chromium accumulates renderer-process cruft over long runs; retire the
+# browser after this many contexts and let the next task (or the
+# keepalive watchdog) launch a fresh one.
+BROWSER_RECYCLE_AFTER = int(os.getenv('KUMO_BROWSER_RECYCLE_AFTER', '100'))
+_contexts_since_launch = 0
+
+async def _recycle_browser():
+    global browser
+    b, browser = browser, None
+    if b is None:
+        return
+    logger.info("Recycling browser after %d contexts.", _contexts_since_launch)
+    try:
+        await b.close()
+    except Exception:
+        logger.exception("Error while recycling browser")
+
+def _note_context_closed(_ctx):
+    _CTX_SEM.release()
+    # Recycle only at a quiet moment — when every remaining open context
+    # is a parked idle one (in particular, when none are open at all).
+    # Closing the browser closes the parked contexts with it; the pool
+    # filters out closed pages on take.
+    if (browser is not None
+            and _contexts_since_launch >= BROWSER_RECYCLE_AFTER
+            and idle_contexts.holds_all(browser.contexts)):
+        asyncio.get_running_loop().create_task(_recycle_browser())
+
+# Warm authenticated contexts parked between tasks. Creating a context and
+# re-verifying the cached session costs a navigation plus a selector wait;
+# a parked page skips both and starts already on the chat UI. Keyed like
+# AuthSessionPool so a context is only ever handed back to its own
+# identity. Parked contexts keep their _CTX_SEM slot until closed;
+# get_page evicts the oldest one when the cap is exhausted, so the cache
+# can never starve live work of context slots.
+IDLE_CONTEXTS_MAX = int(os.getenv('KUMO_IDLE_CONTEXTS', '2'))
+
+class _IdleContextPool:
+    """LIFO pool of logged-in pages, keyed by (url, username)."""
+
+    __slots__ = ('_pages', '_max')
 
-async def get_page(queue=None):
-    """Gets a new page within a new context, reusing the global browser."""
+    def __init__(self, maxsize=IDLE_CONTEXTS_MAX):
+        self._pages = {}
+        self._max = maxsize
+
+    def take(self, key):
+        stack = self._pages.get(key)
+        while stack:
+            page = stack.pop()
+            if not page.is_closed():
+                return page  # LIFO: most recently parked is the warmest
+        return None
+
+    def park(self, key, page):
+        if page.is_closed():
+            return False
+        stack = self._pages.setdefault(key, [])
+        if len(stack) >= self._max:
+            return False
+        stack.append(page)
+        return True
+
+    async def drop(self, key):
+        """Closes parked contexts for a key whose session went stale."""
+        for page in self._pages.pop(key, []):
+            if not page.is_closed():
+                try:
+                    await page.context.close()
+                except PlaywrightError:
+                    pass
+
+    async def evict_oldest(self):
+        """Closes the least-recently parked context, freeing its slot.
+
+        Returns False when nothing is parked. Called by get_page when the
+        context cap is exhausted, so cached idle contexts yield to live
+        work instead of starving it.
+        """
+        for stack in self._pages.values():
+            while stack:
+                page = stack.pop(0)
+                if not page.is_closed():
+                    await _safe_close(page.context)
+                    return True
+        return False
+
+    def holds_all(self, contexts):
+        """True when every context in `contexts` is parked here."""
+        parked = {page.context for stack in self._pages.values()
+                  for page in stack if not page.is_closed()}
+        return all(c in parked for c in contexts)
+
+idle_contexts = _IdleContextPool()
+
+async def _safe_close(context):
+    try:
+        await context.close()
+    except Exception:
+        logger.exception("Error closing browser context")
+
+async def release_page(page, url, username, queue=None):
+    """Parks an authenticated page for reuse, or closes it if the pool is full."""
+    if idle_contexts.park((url, username), page):
+        await log_update(queue, "dev", "Parked authenticated context for reuse.")
+        return
+    # Detach the teardown: the task's result is already final, so there's
+    # no reason for the caller to wait out the close round-trip. The
+    # context's close event still releases the semaphore slot.
+    asyncio.get_running_loop().create_task(_safe_close(page.context))
+
+# The scraper only reads text out of the DOM; images, fonts, stylesheets
+# and media are the bulk of a chat UI's bytes and just delay page-ready.
+# textContent extraction doesn't depend on computed styles, so CSS can go
+# too — that also skips style/layout work per loaded message.
+_BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+
+# Third-party analytics/telemetry hosts that some chat deployments embed.
+_BLOCKED_HOST_FRAGMENTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "segment.io", "sentry.io", "hotjar.com",
+)
+
+async def _block_heavy_resources(route):
+    request = route.request
+    if request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    elif any(host in request.url for host in _BLOCKED_HOST_FRAGMENTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def get_page(queue=None, storage_state=None):
+    """Gets a new page within a new context, reusing the global browser.
+
+    Blocks while KUMO_MAX_CONTEXTS contexts are already open; the slot is
+    freed when the returned page's context closes.
+    """
     b = await init_browser(queue)
     context = None
     page = None
+    # Parked idle contexts hold slots too; when the cap is exhausted,
+    # close them (oldest first) rather than blocking new work behind a
+    # cache. Their close events release the slots this acquire needs.
+    while _CTX_SEM.locked():
+        if not await idle_contexts.evict_oldest():
+            break
+    await _CTX_SEM.acquire()
     try:
-        await log_update(queue, "dev", "Creating new browser context...")
         context = await b.new_context(
+            storage_state=storage_state,
             user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36', # Updated UA
             viewport={'width': 1280, 'height': 800},
             java_script_enabled=True,
             ignore_https_errors=True,
             bypass_csp=True # Can sometimes help with strict sites
         )
-        await log_update(queue, "dev", "Opening new page...")
+        # Release the slot whenever the context closes, on any path.
+        context.once("close", _note_context_closed)
+        global _contexts_since_launch
+        _contexts_since_launch += 1
+        await context.route("**/*", _block_heavy_resources)
         page = await context.new_page()
         page.set_default_timeout(45000)
-        await log_update(queue, "dev", "Page created.")
         return page
     except Exception as e:
-        print(f"\n!!! CRITICAL ERROR IN get_page: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Critical error during page creation")
         await log_update(queue, "error", f"Critical error during page creation: {e}")
         if page: await page.close()
-        if context: await context.close()
+        if context:
+            await context.close() # close event releases the slot
+        else:
+            _CTX_SEM.release()
         raise
 
+async def get_logged_in_page(url, username, password, queue):
+    """Returns a page authenticated against `url`, reusing cached session state.
+
+    Login attempts are serialized per (url, username) so concurrent tasks
+    don't all hit the login form at once; the first success caches the
+    context's storage_state for everyone else.
+    """
+    key = (url, username)
+    async with auth_sessions.lock(key):
+        pooled = idle_contexts.take(key)
+        if pooled is not None:
+            try:
+                # Still on the chat UI from the previous task; a quick
+                # indicator check is the only cost of the warm path.
+                await pooled.wait_for_selector(
+                    SELECTORS["login_success_indicator"], state="visible", timeout=5000)
+                await log_update(queue, "dev", "Reusing warm authenticated context.")
+                return pooled
+            except (PlaywrightError, PlaywrightTimeoutError):
+                await log_update(queue, "dev", "Parked context went stale; discarding.")
+                try:
+                    await pooled.context.close()
+                except PlaywrightError:
+                    pass
+        state = auth_sessions.get_state(key)
+        if state is not None:
+            page = await get_page(queue, storage_state=state)
+            try:
+                # The selector wait below is the real readiness gate;
+                # networkidle rarely settles on a websocket-heavy chat UI.
+                await page.goto(url, wait_until='domcontentloaded', timeout=60000)
+                await page.wait_for_selector(
+                    SELECTORS["login_success_indicator"], state="visible", timeout=15000
+                )
+                await log_update(queue, "info", "Reused cached session; login skipped.")
+                return page
+            except (PlaywrightError, PlaywrightTimeoutError):
+                await log_update(queue, "warn", "Cached session no longer valid, logging in again.")
+                auth_sessions.invalidate(key)
+                await idle_contexts.drop(key)
+                await page.context.close()
+        page = await get_page(queue)
+        try:
+            await perform_login(page, url, username, password, queue)
+            auth_sessions.store(key, await page.context.storage_state())
+        except BaseException:
+            # The caller never sees this page, so its finally can't close
+            # the context — do it here or the context (and its slot under
+            # the context cap) leaks on every failed login.
+            await page.context.close()
+            raise
+        return page
+
 async def perform_login(page, url, username, password, queue):
     """Handles the login process on a given page."""
     await log_update(queue, "info", f"Navigating to {url}...")
     try:
-        await page.goto(url, wait_until='networkidle', timeout=60000)
+        response = await page.goto(url, wait_until='domcontentloaded', timeout=60000)
     except PlaywrightError as e:
         await log_update(queue, "error", f"Navigation Error: {e}. URL: {url}")
         raise
 
+    # Fail fast on a server error page instead of waiting out the
+    # username-field timeout below. A None response (same-document
+    # navigation) is fine.
+    if response is not None and response.status >= 400:
+        raise PlaywrightError(f"Login page returned HTTP {response.status} for {url}.")
+
+    # Gate on the element we actually need rather than network idleness.
+    await page.wait_for_selector(SELECTORS["username_field"], state="visible", timeout=30000)
+
     await log_update(queue, "dev", f"Attempting to fill username with selector: {SELECTORS['username_field']}")
     await page.fill(SELECTORS["username_field"], username, timeout=30000) # Increased timeout
-    await page.wait_for_timeout(random.uniform(500, 1000))
 
     await log_update(queue, "dev", f"Attempting to fill password with selector: {SELECTORS['password_field']}")
     await page.fill(SELECTORS["password_field"], password, timeout=30000) # Increased timeout
-    await page.wait_for_timeout(random.uniform(500, 1000))
 
     await log_update(queue, "info", f"Attempting to click login button with selector: {SELECTORS['login_button']}")
     await page.click(SELECTORS["login_button"], timeout=30000) # Increased timeout
 
     await log_update(queue, "dev", "Waiting for login outcome...")
-    try:
-        # Wait for either a success or an error indicator
-        await page.wait_for_selector(
-            f'{SELECTORS["login_success_indicator"]}, {SELECTORS["login_error_indicator"]}',
-            state="visible",
-            timeout=45000 # Increased timeout for post-login page load
-        )
-        # Check if the error indicator is present
-        error_element = await page.query_selector(SELECTORS["login_error_indicator"])
-        if error_element:
-            error_text_list = await error_element.all_text_contents()
-            error_text = " ".join(error_text_list).strip() if error_text_list else "Login Error element found, but could not get text."
-            raise PlaywrightError(f"Login Failed: {error_text}. Check credentials or error indicator selector.")
-        
-        # If no error, check for success indicator to be sure
-        await page.wait_for_selector(SELECTORS["login_success_indicator"], state="visible", timeout=15000)
-        await log_update(queue, "success", "Login successful (success indicator found).")
-        return True
-    except PlaywrightTimeoutError:
+    # Races success vs. error in-page so a bad password fails fast, and
+    # carries the error text back without a follow-up element probe.
+    kind, error_text = await _wait_login_outcome(page, timeout=45000)
+    if kind == "error":
+        error_text = error_text or "Login Error element found, but could not get text."
+        raise PlaywrightError(f"Login Failed: {error_text}. Check credentials or error indicator selector.")
+    if kind == "timeout":
         raise PlaywrightError("Login Timed Out: Could not confirm login success or failure. Check login_success_indicator and login_error_indicator selectors, and page load speed after login.")
 
+    await log_update(queue, "success", "Login successful (success indicator found).")
+    return True
+
 async def login_and_enumerate_task(url, username, password, log_queue):
     page = None
     try:
-        page = await get_page(log_queue)
-        await perform_login(page, url, username, password, log_queue)
+        page = await get_logged_in_page(url, username, password, log_queue)
 
         await log_update(log_queue, "info", "Enumerating channels...")
         channels_data = []
         # Wait for the container that holds channel items
         await page.wait_for_selector(SELECTORS["channel_list_container"], state="visible", timeout=30000)
-        channel_elements = await page.query_selector_all(SELECTORS["channel_list_container"])
+        # Names and hrefs come back in one call instead of 3-4 CDP
+        # round-trips per sidebar item; Playwright matches the items and
+        # hands the element array to the extractor, like the message path.
+        raw_channels = await page.eval_on_selector_all(
+            SELECTORS["channel_list_container"], _CHANNELS_EXTRACT_JS,
+            SELECTORS["channel_name_in_item"])
 
-        if not channel_elements:
+        if not raw_channels:
             await log_update(log_queue, "error", f"No channel elements found using selector: {SELECTORS['channel_list_container']}")
         else:
-            await log_update(log_queue, "dev", f"Found {len(channel_elements)} potential channel elements.")
-            base_url_match = re.match(r"^(https://[^/]+)", page.url)
-            base_url = base_url_match.group(1) if base_url_match else url.rstrip('/')
-
-            for el in channel_elements:
-                name_el = await el.query_selector(SELECTORS["channel_name_in_item"])
-                if name_el:
-                    name = (await name_el.inner_text()).strip()
-                    href = await el.get_attribute('href') # 'a.rcx-sidebar-item' means el is the 'a' tag
-                    
-                    if name and href:
-                        nav_id = href if href.startswith('http') else base_url + (href if href.startswith('/') else '/' + href)
-                        channels_data.append({"name": name, "id": nav_id})
-                        await log_update(log_queue, "dev", f"Found channel: {name} ({nav_id})")
-                    else:
-                        await log_update(log_queue, "warn", f"Channel element found, but missing name or href. Name el: {name_el}, Href: {href}")
-                else:
-                    await log_update(log_queue, "warn", f"Channel name element not found in item using selector: {SELECTORS['channel_name_in_item']}")
+            await log_update(log_queue, "dev", f"Found {len(raw_channels)} channel elements.")
+
+            for item in raw_channels:
+                name, href = item["name"], item["href"]
+                # urljoin handles absolute hrefs, root-relative paths and
+                # bare fragments uniformly against the post-login page URL.
+                nav_id = urljoin(page.url, href)
+                channels_data.append({"name": name, "id": nav_id})
+                await log_update(log_queue, "dev", f"Found channel: {name} ({nav_id})")
 
 
         if channels_data:
@@ -184,60 +900,75 @@ async def login_and_enumerate_task(url, username, password, log_queue):
 
     except (PlaywrightError, PlaywrightTimeoutError) as e:
         error_message = f"A Playwright error occurred: {str(e)}"
-        print(f"!!! PLAYWRIGHT ERROR in login_and_enumerate_task: {str(e)}"); traceback.print_exc()
+        logger.exception("Playwright error in login_and_enumerate_task")
         await log_update(log_queue, "error", error_message)
         await log_update(log_queue, "end_stream", "Process failed (Playwright Error).")
     except Exception as e:
         error_message = f"An unexpected error occurred in login_and_enumerate_task: {str(e)}."
-        print(f"!!! UNEXPECTED ERROR in login_and_enumerate_task: {str(e)}"); traceback.print_exc()
+        logger.exception("Unexpected error in login_and_enumerate_task")
         await log_update(log_queue, "error", error_message)
         await log_update(log_queue, "end_stream", "Process failed (Unexpected Error).")
     finally:
         if page and not page.is_closed():
-            try:
-                await page.context.close() # Closing context also closes the page
-            except Exception as e_close:
-                await log_update(log_queue, "warn", f"Error closing page context: {e_close}")
+            # Hand the still-authenticated context back for the next task
+            # instead of tearing it down; release_page closes it if the
+            # pool is already full.
+            await release_page(page, url, username, log_queue)
 
-async def scrape_messages_task(url, username, password, channel_url, depth, log_queue):
+async def scrape_messages_task(url, username, password, channel_url, depth, log_queue, output_path=None):
     page = None
     scraped_data = []
+    total_scraped = 0
+    # With output_path set, rows stream to a JSONL file as they are parsed
+    # instead of accumulating in memory — long channels then scrape at
+    # constant resident size. The web app keeps the in-memory path so the
+    # download route still works; this is for programmatic callers.
+    out_file = open(output_path, 'ab') if output_path else None
     try:
-        page = await get_page(log_queue)
-        # Perform login (even if theoretically logged in from enumeration, a new context/page needs it)
-        await perform_login(page, url, username, password, log_queue)
+        # Reuses the session cached during enumeration; only logs in if the
+        # cached state is missing or stale.
+        page = await get_logged_in_page(url, username, password, log_queue)
 
         await log_update(log_queue, "info", f"Navigating to channel: {channel_url}")
-        await page.goto(channel_url, wait_until='networkidle', timeout=60000)
-        
-        await page.wait_for_selector(SELECTORS["room_title_header"], timeout=30000)
+        # Client-side route into the channel where possible; the helper
+        # waits on room_title_header as the readiness signal either way.
+        await _navigate_to_channel(page, channel_url, log_queue)
         channel_name_handle = await page.query_selector(SELECTORS["room_title_header"])
-        channel_name = await channel_name_handle.inner_text() if channel_name_handle else "Unknown Channel"
+        channel_name = await channel_name_handle.text_content() if channel_name_handle else "Unknown Channel"
         await log_update(log_queue, "success", f"Entered channel: {channel_name.strip()}")
-        await page.wait_for_timeout(random.uniform(2000, 3000)) # Wait for messages to load
 
         await log_update(log_queue, "info", "Starting message scraping...")
-        await page.wait_for_selector(SELECTORS["scrollable_message_container"], state="visible", timeout=30000)
-        
+        # The container element is stable for the lifetime of the channel
+        # view, so grab its handle once instead of re-querying every pass.
+        scroll_container_handle = await page.wait_for_selector(
+            _SCROLL_CONTAINER_SEL, state="visible", timeout=30000)
+
         three_months_ago = datetime.now() - timedelta(days=90)
-        seen_message_ids = set()
+        depth_limited = depth == "3months" # hoisted out of the per-message loop
+        seen_message_ids = _RecentIds()
         keep_scrolling = True
         consecutive_no_new_messages_passes = 0
         scroll_attempts_at_top = 0
 
+        # Per-message/per-pass dev chatter goes through the batcher; flushed
+        # once per pass so it becomes one frame instead of dozens.
+        dev_logs = _LogBatcher(log_queue)
+
         while keep_scrolling:
-            await log_update(log_queue, "dev", "Looking for messages...")
+            dev_logs.flush()
+            if _DEV_LOGS:
+                log_update_bytes(log_queue, _LOOKING_FOR_MESSAGES_FRAME)
             messages_found_this_pass = 0
             # Ensure message items are loaded
             try:
-                await page.wait_for_selector(SELECTORS["message_item_li"], state="attached", timeout=10000)
+                await page.wait_for_selector(_MESSAGE_ITEM_SEL, state="attached", timeout=10000)
             except PlaywrightTimeoutError:
                 await log_update(log_queue, "warn", f"No message items attached after waiting (selector: {SELECTORS['message_item_li']}). Trying to scroll.")
                 # Try a scroll if no messages are initially visible or attached
-                current_scroll_top = await page.evaluate(f'document.querySelector("{SELECTORS["scrollable_message_container"]}").scrollTop')
-                await page.evaluate(f'document.querySelector("{SELECTORS["scrollable_message_container"]}").scrollTop = 0')
-                await page.wait_for_timeout(random.uniform(3000, 5000)) # Longer wait after scroll
-                new_scroll_top = await page.evaluate(f'document.querySelector("{SELECTORS["scrollable_message_container"]}").scrollTop')
+                current_scroll_top = await scroll_container_handle.evaluate(_JS_GET_SCROLL_TOP)
+                await scroll_container_handle.evaluate(_JS_SCROLL_TOP_ZERO)
+                await _wait_for_new_messages(page, 0) # Returns as soon as anything loads
+                new_scroll_top = await scroll_container_handle.evaluate(_JS_GET_SCROLL_TOP)
                 if new_scroll_top == current_scroll_top and current_scroll_top == 0: # if scroll didn't change and we are at top
                      scroll_attempts_at_top +=1
                      if scroll_attempts_at_top > 2:
@@ -247,81 +978,62 @@ async def scrape_messages_task(url, username, password, channel_url, depth, log_
                 else:
                     scroll_attempts_at_top = 0 # Reset if scroll happened or not at top
 
-            message_elements = await page.query_selector_all(SELECTORS["message_item_li"])
+            # One call pulls id/sender/text/timestamp for every *new* message
+            # since the previous pass; the page-side Set keeps marshaling
+            # O(new) even as the DOM grows to thousands of items.
+            payload = await page.eval_on_selector_all(
+                _MESSAGE_ITEM_SEL, _MESSAGES_EXTRACT_JS, _MESSAGE_EXTRACT_ARGS)
+            rows, dom_total = payload["rows"], payload["total"]
 
-            if not message_elements:
+            if not dom_total:
                  consecutive_no_new_messages_passes += 1
                  await log_update(log_queue, "warn", f"No message elements found on pass {consecutive_no_new_messages_passes} (selector: {SELECTORS['message_item_li']}).")
                  if consecutive_no_new_messages_passes > 3: # Give up after a few tries
                      await log_update(log_queue, "warn", "No messages found for several passes. Stopping scroll for this channel.")
                      keep_scrolling = False
-                 await page.wait_for_timeout(3000) # Wait a bit before retrying or scrolling
                  # Attempt to scroll to load messages if none are found
-                 await page.evaluate(f'document.querySelector("{SELECTORS["scrollable_message_container"]}").scrollTop = 0')
-                 await page.wait_for_timeout(random.uniform(2500, 4000))
+                 await scroll_container_handle.evaluate(_JS_SCROLL_TOP_ZERO)
+                 await _wait_for_new_messages(page, 0, timeout=6000)
                  continue
             
             consecutive_no_new_messages_passes = 0 # Reset if elements were found
 
-            for msg_element in reversed(message_elements): # Process oldest visible first
-                msg_id = await msg_element.get_attribute('id')
-                if not msg_id or msg_id in seen_message_ids:
+            for row in reversed(rows): # Process oldest visible first
+                msg_id = row["id"]
+                if not msg_id or not seen_message_ids.add(msg_id):
                     continue
-                seen_message_ids.add(msg_id)
-                
-                try:
-                    sender_el = await msg_element.query_selector(SELECTORS["message_sender"])
-                    text_container_el = await msg_element.query_selector(SELECTORS["message_text"])
-                    ts_el = await msg_element.query_selector(SELECTORS["message_timestamp"])
-
-                    sender = (await sender_el.inner_text()).strip() if sender_el else "Unknown Sender"
-                    
-                    # Extract text: handle direct text, or look for common patterns within message_body
-                    text_content = []
-                    if text_container_el:
-                        # Try to get direct text from children, skipping complex structures if needed
-                        children_texts = await text_container_el.query_selector_all('div > *, span > *') # more specific
-                        if not children_texts: # Fallback to all direct children text nodes
-                            all_text = await text_container_el.all_inner_texts()
-                            text_content = [t.strip() for t in all_text if t.strip()]
-                        else:
-                           for child in children_texts:
-                                text_content.append((await child.inner_text()).strip())
-                    text = " ".join(filter(None, text_content))
-                    if not text and text_container_el : # If still no text, try inner_text of the body itself
-                        text = (await text_container_el.inner_text()).strip()
-
-
-                    ts_text_title = await ts_el.get_attribute('title') if ts_el else ""
-                    
-                    msg_time = None
-                    if ts_text_title:
-                        try: # Format like: "May 21, 2025 10:47 PM"
-                           msg_time = datetime.strptime(ts_text_title, '%b %d, %Y %I:%M %p')
-                        except ValueError:
-                            try: # Format like: "10:00 PM, August 23, 2023"
-                                msg_time = datetime.strptime(ts_text_title, '%I:%M %p, %B %d, %Y')
-                            except ValueError:
-                               await log_update(log_queue, "dev", f"Could not parse timestamp '{ts_text_title}' with known formats. Storing as text.")
-                    
-                    scraped_data.append({
-                        "id": msg_id, "sender": sender, "text": text,
-                        "timestamp_raw": ts_text_title, "timestamp_dt": msg_time.isoformat() if msg_time else None
-                    })
-                    messages_found_this_pass += 1
-
-                    if depth == "3months" and msg_time and msg_time < three_months_ago:
-                        await log_update(log_queue, "info", "Reached 3-month depth limit. Stopping scroll.")
-                        keep_scrolling = False
-                        break 
-                except Exception as parse_err:
-                    await log_update(log_queue, "warn", f"Could not parse message details for ID {msg_id or 'UNKNOWN'}: {parse_err}")
+
+                ts_text_title = row["ts"]
+
+                msg_time = None
+                if ts_text_title:
+                    msg_time = _parse_timestamp(ts_text_title)
+                    if msg_time is None:
+                        dev_logs.push(f"Could not parse timestamp '{ts_text_title}' with known formats. Storing as text.")
+
+                record = {
+                    "id": msg_id, "sender": row["sender"], "text": row["text"],
+                    # orjson serializes datetime natively (RFC 3339); no need
+                    # to pay for isoformat() per message here.
+                    "timestamp_raw": ts_text_title, "timestamp_dt": msg_time
+                }
+                if out_file is not None:
+                    out_file.write(orjson.dumps(record) + b'\n')
+                else:
+                    scraped_data.append(record)
+                total_scraped += 1
+                messages_found_this_pass += 1
+
+                if depth_limited and msg_time and msg_time < three_months_ago:
+                    await log_update(log_queue, "info", "Reached 3-month depth limit. Stopping scroll.")
+                    keep_scrolling = False
+                    break
 
             if not keep_scrolling: break # Exit outer while loop if depth limit reached
 
-            if messages_found_this_pass == 0 and len(message_elements) > 0:
+            if messages_found_this_pass == 0 and dom_total > 0:
                 scroll_attempts_at_top += 1
-                await log_update(log_queue, "info", f"No *new* messages found this pass, though {len(message_elements)} elements exist. Scroll attempts at top: {scroll_attempts_at_top}/3.")
+                await log_update(log_queue, "info", f"No *new* messages found this pass, though {dom_total} elements exist. Scroll attempts at top: {scroll_attempts_at_top}/3.")
                 if scroll_attempts_at_top >= 3:
                     await log_update(log_queue, "info", "Likely at the top of the channel history with no new messages. Stopping scroll.")
                     break
@@ -330,58 +1042,74 @@ async def scrape_messages_task(url, username, password, channel_url, depth, log_
 
             if not keep_scrolling: break
 
-            await log_update(log_queue, "dev", f"Scraped {len(scraped_data)} total messages. Scrolling up in {SELECTORS['scrollable_message_container']}...")
+            dev_logs.push(f"Scraped {total_scraped} total messages. Scrolling up in {SELECTORS['scrollable_message_container']}...")
             try:
-                scroll_container_handle = await page.query_selector(SELECTORS["scrollable_message_container"])
-                if not scroll_container_handle:
-                    await log_update(log_queue, "error", "Scrollable message container not found. Stopping scroll.")
-                    break
-                
-                # Get current scroll height before scrolling
-                # prev_scroll_height = await scroll_container_handle.evaluate('node => node.scrollHeight')
-                await scroll_container_handle.evaluate('node => node.scrollTop = 0')
-                await page.wait_for_timeout(random.uniform(3000, 5000)) # Wait for content to load
-                
-                # Optional: Check if loading indicator appeared/disappeared
-                try:
-                    loading_el = await page.query_selector(SELECTORS["loading_indicator"])
-                    if loading_el:
-                        await page.wait_for_selector(SELECTORS["loading_indicator"], state='visible', timeout=1500)
-                        await page.wait_for_selector(SELECTORS["loading_indicator"], state='hidden', timeout=15000)
-                except PlaywrightTimeoutError:
-                    await log_update(log_queue, "dev", "Loading indicator state change not detected as expected, or no indicator.")
-                
-                # Check if we're stuck at the top
-                # current_scroll_height = await scroll_container_handle.evaluate('node => node.scrollHeight')
-                # if current_scroll_height == prev_scroll_height and await scroll_container_handle.evaluate('node => node.scrollTop') == 0:
-                #     scroll_attempts_at_top +=1
-                #     if scroll_attempts_at_top > 2:
-                #          await log_update(log_queue, "info", "Scroll height hasn't changed and at top. Assuming end of messages.")
-                #          keep_scrolling = False
-                # else:
-                #     scroll_attempts_at_top = 0
-
-
+                prev_h = await scroll_container_handle.evaluate(_JS_GET_SCROLL_HEIGHT)
+                await scroll_container_handle.evaluate(_JS_SCROLL_TOP_ZERO)
+                # Resume the moment older history is injected into the DOM
+                # instead of sleeping a fixed interval. The wait resolves on
+                # either more items or a taller container — the latter covers
+                # virtualized lists whose rendered count stays flat.
+                if not await _wait_for_new_messages(page, dom_total, prev_height=prev_h):
+                    dev_logs.push("No new messages appeared within the scroll wait.")
             except Exception as scroll_err:
                  await log_update(log_queue, "error", f"Error during scrolling: {scroll_err}. Stopping.")
                  keep_scrolling = False
         
-        await log_update(log_queue, "success", f"Scraping finished for '{channel_name.strip()}'. Found {len(scraped_data)} messages.")
-        await log_update(log_queue, "scrape_result", {"channel_name": channel_name.strip(), "messages": scraped_data})
+        dev_logs.flush()
+        await log_update(log_queue, "success", f"Scraping finished for '{channel_name.strip()}'. Found {total_scraped} messages.")
+        result = {"channel_name": channel_name.strip(), "messages": scraped_data}
+        if output_path:
+            result["output_path"] = output_path
+            result["message_count"] = total_scraped
+        await log_update(log_queue, "scrape_result", result)
         # "end_stream" for the *entire operation* is handled in app.py after all scrape tasks complete.
 
     except (PlaywrightError, PlaywrightTimeoutError) as e:
         error_message = f"A Playwright error occurred during scraping for {channel_url}: {str(e)}"
-        print(f"!!! PLAYWRIGHT ERROR during scraping: {str(e)}"); traceback.print_exc()
+        logger.exception("Playwright error during scraping for %s", channel_url)
         await log_update(log_queue, "error", error_message)
         # Let app.py handle end_stream for multi-channel scrapes
     except Exception as e:
         error_message = f"An unexpected error occurred during scraping for {channel_url}: {str(e)}."
-        print(f"!!! UNEXPECTED ERROR during scraping: {str(e)}"); traceback.print_exc()
+        logger.exception("Unexpected error during scraping for %s", channel_url)
         await log_update(log_queue, "error", error_message)
     finally:
+        if out_file is not None:
+            out_file.close()
         if page and not page.is_closed():
-            try:
-                await page.context.close()
-            except Exception as e_close:
-                await log_update(log_queue, "warn", f"Error closing page context after scraping {channel_url}: {e_close}")
\ No newline at end of file
+            await release_page(page, url, username, log_queue)
+
+async def login_and_enumerate_many(targets, concurrency=4):
+    """Enumerates channels for several targets concurrently.
+
+    `targets` is an iterable of (url, username, password, log_queue)
+    tuples; each runs in its own context off the shared browser, bounded
+    by `concurrency` on top of the global context cap. Like scrape_many,
+    this is the programmatic fan-out entry point — the web app drives
+    single targets through its worker pool instead.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(target):
+        url, username, password, log_queue = target
+        async with sem:
+            await login_and_enumerate_task(url, username, password, log_queue)
+
+    await asyncio.gather(*[_one(t) for t in targets])
+
+async def scrape_many(url, username, password, channel_urls, depth, log_queue, concurrency=4):
+    """Scrapes several channels concurrently against the shared browser.
+
+    Channels are independent, so they fan out under a semaphore; the
+    session pool means only the first one pays the login, and the context
+    cap in get_page still bounds total browser memory. The web app drives
+    its own worker pool instead — this is the programmatic entry point.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(channel_url):
+        async with sem:
+            await scrape_messages_task(url, username, password, channel_url, depth, log_queue)
+
+    await asyncio.gather(*[_one(c) for c in channel_urls])
\ No newline at end of file